@@ -5,16 +5,66 @@ from datetime import datetime, timedelta
 import os
 import sys
 from collections import defaultdict
+from functools import lru_cache
+from itertools import repeat
 import json
+import orjson
 import re
 
+# Движок calamine поддерживается pandas начиная с версии 2.2
+try:
+    import python_calamine  # noqa: F401
+    _PANDAS_VERSION = tuple(int(x) for x in re.findall(r'\d+', pd.__version__)[:2])
+    EXCEL_ENGINE = 'calamine' if _PANDAS_VERSION >= (2, 2) else 'openpyxl'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+# Базовые цены на основные материалы в порядке приоритета категорий
+PRICE_KEYWORDS = (
+    (('стекло', 'glass'), 1500),
+    (('профиль', 'profile'), 800),
+    (('аргон', 'argon'), 200),
+    (('герметик', 'sealant'), 1500),
+    (('лента', 'tape'), 300),
+    (('соединитель', 'connector'), 500),
+)
+DEFAULT_PRICE = 1000  # цена по умолчанию
+
+@lru_cache(maxsize=None)
+def _estimate_price(material):
+    """Оценочная стоимость материала по ключевым словам в названии"""
+    material_lower = material.lower()
+    for keywords, price in PRICE_KEYWORDS:
+        if any(x in material_lower for x in keywords):
+            return price
+    return DEFAULT_PRICE
+
+def _json_default(obj):
+    """Сериализация значений, которые orjson не поддерживает напрямую (pd.Timestamp, pd.NA)"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if obj is pd.NA:
+        return None
+    raise TypeError
+
 class ProductionPlanner:
     def __init__(self, excel_file):
         self.excel_file = excel_file
         self.orders_df = None
         self.materials_df = None
         self.stock_data = {}
-        self.reserved_materials = defaultdict(float)
+        self._order_keys = None
+        self._client_keys = None
+        self._companies = []
+        self._orders_by_num = {}
+        self._mat_matrix = np.empty((0, 0))
+        self._order_col_groups = {}
+        self._material_names = ()
+        self._material_index = {}
+        self._unique_material_names = ()
+        self._reserved_arr = np.zeros(0)
+        self._stock_arr = np.zeros(0)
+        self._reserved_extra = {}
         self.selected_orders = {}
         self.load_data()
     
@@ -23,19 +73,78 @@ class ProductionPlanner:
         try:
             print("📂 Загрузка данных из Excel файла...")
             
-            # Загружаем лист с заказами
-            self.orders_df = pd.read_excel(self.excel_file, sheet_name='Заказы')
+            # Открываем книгу один раз и читаем из нее оба листа
+            with pd.ExcelFile(self.excel_file, engine=EXCEL_ENGINE) as xl:
+                # Загружаем лист с заказами
+                self.orders_df = xl.parse(
+                    'Заказы',
+                    dtype={'Номер заказа': 'string', 'Клиент': 'string'}
+                )
+                
+                # Загружаем лист с материалами
+                self.materials_df = xl.parse(
+                    'Потребность материалов',
+                    dtype={'Материал': 'string'}
+                )
+            
+            # Нормализованные номера заказов и клиенты для сравнений
+            missing_keys = pd.Series(pd.NA, index=self.orders_df.index, dtype='string')
+            if 'Номер заказа' in self.orders_df.columns:
+                self._order_keys = self.orders_df['Номер заказа'].astype('string').str.strip()
+            else:
+                self._order_keys = missing_keys
+            if 'Клиент' in self.orders_df.columns:
+                self._client_keys = self.orders_df['Клиент'].astype('string')
+            else:
+                self._client_keys = missing_keys
+            self._companies = sorted(self._client_keys.dropna().unique().tolist())
             
-            # Загружаем лист с материалами
-            self.materials_df = pd.read_excel(self.excel_file, sheet_name='Потребность материалов')
+            # Индекс строк заказов по номеру (первое вхождение)
+            self._orders_by_num = {}
+            for idx, order_num in enumerate(self._order_keys.tolist()):
+                if pd.notna(order_num):
+                    self._orders_by_num.setdefault(order_num, idx)
+            
+            # Числовая матрица потребностей: строки - материалы, колонки - заказы.
+            # Хранится по колонкам, чтобы выборка колонок заказа читалась подряд
+            if 'Материал' in self.materials_df.columns:
+                material_mask = self.materials_df['Материал'].notna()
+                self._material_names = tuple(
+                    self.materials_df.loc[material_mask, 'Материал'].astype(str).str.strip().tolist()
+                )
+            else:
+                material_mask = pd.Series(False, index=self.materials_df.index)
+                self._material_names = ()
+            numeric_df = self.materials_df[material_mask].drop(columns=['Материал', 'На складе'], errors='ignore')
+            self._mat_matrix = np.asfortranarray(
+                numeric_df.apply(pd.to_numeric, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+            )
+            
+            # Сопоставляем номера заказов с индексами колонок матрицы:
+            # точное совпадение названия или одно из слов в названии
+            order_col_groups = defaultdict(list)
+            for col_idx, col in enumerate(numeric_df.columns):
+                col_str = str(col).strip()
+                for token in set(col_str.split()) | {col_str}:
+                    order_col_groups[token].append(col_idx)
+            self._order_col_groups = dict(order_col_groups)
+            
+            # Резервы хранятся массивом по индексу материала; при перезагрузке
+            # данных переносим уже сделанные резервирования на новый индекс
+            reserved = self.reserved_snapshot()
+            self._unique_material_names = tuple(dict.fromkeys(self._material_names))
+            self._material_index = {name: i for i, name in enumerate(self._unique_material_names)}
+            self._set_reserved(reserved)
             
             # Создаем словарь остатков на складе из колонки "На складе"
             if 'На складе' in self.materials_df.columns:
-                for _, row in self.materials_df.iterrows():
-                    material = row['Материал']
-                    if pd.notna(material):
-                        stock = row['На складе'] if pd.notna(row['На складе']) else 0
-                        self.stock_data[str(material).strip()] = float(stock)
+                stock = pd.to_numeric(self.materials_df['На складе'][material_mask], errors='coerce').fillna(0.0)
+                self.stock_data = dict(zip(self._material_names, stock.astype(float).tolist()))
+            
+            # Остатки массивом в том же порядке, что и резервы
+            self._stock_arr = np.array(
+                [self.stock_data.get(name, 0.0) for name in self._unique_material_names], dtype=float
+            )
             
             print(f"✅ Загружено: {len(self.orders_df)} заказов, {len(self.materials_df)} материалов")
             
@@ -43,14 +152,37 @@ class ProductionPlanner:
             print(f"❌ Ошибка загрузки данных: {e}")
             raise
     
+    def reserved_snapshot(self):
+        """Копия резервов в виде словаря название -> количество (изменения не сохраняются)"""
+        reserved = dict(self._reserved_extra)
+        for idx in np.flatnonzero(self._reserved_arr).tolist():
+            reserved[self._unique_material_names[idx]] = float(self._reserved_arr[idx])
+        return reserved
+    
+    def _set_reserved(self, reserved):
+        """Заполнить массив резервов из словаря название -> количество"""
+        self._reserved_arr = np.zeros(len(self._material_index))
+        # Материалы, которых нет в текущей таблице, храним отдельно, чтобы не потерять
+        self._reserved_extra = {}
+        for material, quantity in reserved.items():
+            idx = self._material_index.get(material)
+            if idx is None:
+                self._reserved_extra[material] = float(quantity)
+            else:
+                self._reserved_arr[idx] += float(quantity)
+    
     def get_companies(self):
         """Получить список компаний"""
-        return sorted([str(x) for x in self.orders_df['Клиент'].unique() if pd.notna(x)])
+        return self._companies
+    
+    def get_order_numbers(self):
+        """Получить список номеров заказов"""
+        return self._order_keys.dropna().unique().tolist()
     
     def get_orders_by_company(self, company=None):
         """Получить заказы по компании"""
         if company and company != "Все компании":
-            return self.orders_df[self.orders_df['Клиент'] == company]
+            return self.orders_df[(self._client_keys == company).fillna(False).astype(bool)]
         return self.orders_df
     
     def select_orders(self, order_numbers, shipment_dates):
@@ -60,10 +192,10 @@ class ProductionPlanner:
         for order_num in order_numbers:
             # Преобразуем номер заказа к строке для сравнения
             order_num_str = str(order_num).strip()
-            order_data = self.orders_df[self.orders_df['Номер заказа'].astype(str).str.strip() == order_num_str]
+            idx = self._orders_by_num.get(order_num_str)
             
-            if not order_data.empty:
-                order_info = order_data.iloc[0].to_dict()
+            if idx is not None:
+                order_info = self.orders_df.iloc[idx].to_dict()
                 order_info['Дата отгрузки'] = shipment_dates.get(order_num_str)
                 self.selected_orders[order_num_str] = order_info
         
@@ -78,63 +210,47 @@ class ProductionPlanner:
         required_materials = defaultdict(float)
         order_materials = {}
         
-        # Получаем все материалы из таблицы потребности
-        all_materials = []
-        if 'Материал' in self.materials_df.columns:
-            all_materials = [str(x).strip() for x in self.materials_df['Материал'] if pd.notna(x)]
+        # Все материалы из таблицы потребности (строки матрицы)
+        all_materials = self._material_names
         
         # Для каждого выбранного заказа находим его материалы
         for order_num in self.selected_orders.keys():
             order_num_clean = str(order_num).strip()
             
-            # Ищем колонку с этим заказом в таблице материалов
-            order_columns = []
-            for col in self.materials_df.columns:
-                col_str = str(col).strip()
-                # Ищем точное совпадение или частичное (если есть дополнительные символы)
-                if order_num_clean == col_str or order_num_clean in col_str.split():
-                    order_columns.append(col)
+            # Ищем колонки с этим заказом в таблице материалов
+            col_idx = self._order_col_groups.get(order_num_clean)
             
-            if order_columns:
-                for material_idx, material_name in enumerate(all_materials):
-                    total_requirement = 0
-                    
-                    for order_col in order_columns:
-                        if order_col in self.materials_df.columns:
-                            value = self.materials_df[order_col].iloc[material_idx]
-                            if pd.notna(value) and value != 0:
-                                try:
-                                    total_requirement += float(value)
-                                except (ValueError, TypeError):
-                                    pass
-                    
-                    if total_requirement > 0:
-                        required_materials[material_name] += total_requirement
-                        if order_num not in order_materials:
-                            order_materials[order_num] = {}
-                        order_materials[order_num][material_name] = total_requirement
+            if col_idx:
+                # Суммируем потребность по всем колонкам заказа сразу для всех материалов
+                totals = self._mat_matrix[:, col_idx].sum(axis=1)
+                
+                # Обходим только материалы с ненулевой потребностью
+                for material_idx in np.flatnonzero(totals > 0).tolist():
+                    material_name = all_materials[material_idx]
+                    total_requirement = float(totals[material_idx])
+                    required_materials[material_name] += total_requirement
+                    if order_num not in order_materials:
+                        order_materials[order_num] = {}
+                    order_materials[order_num][material_name] = total_requirement
         
-        # Рассчитываем остатки после резервирования
-        material_balance = {}
-        purchase_requirements = {}
+        # Рассчитываем остатки после резервирования по всем материалам сразу
+        required = pd.Series(required_materials, dtype=float)
+        idx = [self._material_index[material] for material in required_materials]
+        stock = pd.Series(self._stock_arr[idx], index=required.index)
+        reserved = pd.Series(self._reserved_arr[idx], index=required.index)
+        available_stock = (stock - reserved).clip(lower=0)
+        balance_after = available_stock - required
         
-        for material, required in required_materials.items():
-            current_stock = self.stock_data.get(material, 0)
-            reserved = self.reserved_materials.get(material, 0)
-            available_stock = max(0, current_stock - reserved)
-            
-            balance_after = available_stock - required
-            material_balance[material] = {
-                'Текущий запас': current_stock,
-                'Уже зарезервировано': reserved,
-                'Доступно сейчас': available_stock,
-                'Требуется для выбранных': required,
-                'Остаток после': balance_after
-            }
-            
-            # Если будет дефицит - добавляем в заявку на закупку
-            if balance_after < 0:
-                purchase_requirements[material] = abs(balance_after)
+        material_balance = pd.DataFrame({
+            'Текущий запас': stock,
+            'Уже зарезервировано': reserved,
+            'Доступно сейчас': available_stock,
+            'Требуется для выбранных': required,
+            'Остаток после': balance_after
+        }).to_dict('index')
+        
+        # Если будет дефицит - добавляем в заявку на закупку
+        purchase_requirements = (-balance_after[balance_after < 0]).to_dict()
         
         return {
             'material_requirements': dict(required_materials),
@@ -154,51 +270,65 @@ class ProductionPlanner:
         if 'error' in requirements:
             return requirements
         
-        # Резервируем материалы
-        for material, required in requirements['material_requirements'].items():
-            self.reserved_materials[material] += required
+        # Резервируем материалы одной операцией над массивом
+        required = requirements['material_requirements']
+        idx = np.fromiter((self._material_index[m] for m in required), dtype=np.intp, count=len(required))
+        np.add.at(self._reserved_arr, idx, np.fromiter(required.values(), dtype=float, count=len(required)))
         
         # Сохраняем информацию о резервировании
-        self.save_reservation_data()
+        reserved_materials = self.save_reservation_data()
         
         return {
             'status': 'success',
             'reserved_orders': list(self.selected_orders.keys()),
-            'reserved_materials': dict(self.reserved_materials),
+            'reserved_materials': reserved_materials,
             'requirements': requirements
         }
     
     def save_reservation_data(self):
-        """Сохранить данные о резервировании"""
-        # Конвертируем даты в строки для JSON
-        serializable_orders = {}
-        for order_num, order_info in self.selected_orders.items():
-            serializable_order = order_info.copy()
-            if 'Дата отгрузки' in serializable_order and serializable_order['Дата отгрузки']:
-                if isinstance(serializable_order['Дата отгрузки'], datetime):
-                    serializable_order['Дата отгрузки'] = serializable_order['Дата отгрузки'].isoformat()
-            serializable_orders[order_num] = serializable_order
+        """Сохранить данные о резервировании, вернуть сохраненный словарь резервов"""
+        reserved_materials = self.reserved_snapshot()
         
+        # Даты и числа NumPy orjson сериализует сам
         reservation_data = {
-            'reserved_materials': dict(self.reserved_materials),
-            'selected_orders': serializable_orders,
-            'timestamp': datetime.now().isoformat()
+            'reserved_materials': reserved_materials,
+            'selected_orders': self.selected_orders,
+            'timestamp': datetime.now()
         }
         
+        tmp_file = 'reservations.json.tmp'
         try:
-            with open('reservations.json', 'w', encoding='utf-8') as f:
-                json.dump(reservation_data, f, ensure_ascii=False, indent=2)
+            data = orjson.dumps(
+                reservation_data,
+                default=_json_default,
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+            )
+            # Пишем во временный файл и атомарно заменяем, чтобы не оставить оборванный JSON
+            with open(tmp_file, 'wb', buffering=1 << 20) as f:
+                f.write(data)
+            os.replace(tmp_file, 'reservations.json')
             print("💾 Данные резервирования сохранены")
         except Exception as e:
             print(f"⚠️ Не удалось сохранить данные резервирования: {e}")
+            try:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+            except OSError:
+                pass
+        return reserved_materials
     
     def load_reservation_data(self):
         """Загрузить данные о резервировании"""
         try:
             if os.path.exists('reservations.json'):
-                with open('reservations.json', 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.reserved_materials = defaultdict(float, data.get('reserved_materials', {}))
+                with open('reservations.json', 'rb') as f:
+                    raw = f.read()
+                    try:
+                        data = orjson.loads(raw)
+                    except orjson.JSONDecodeError:
+                        # Файлы старых версий могут содержать NaN, который orjson не читает
+                        data = json.loads(raw)
+                    self._set_reserved(data.get('reserved_materials', {}))
                     
                     # Восстанавливаем даты из строк
                     loaded_orders = data.get('selected_orders', {})
@@ -218,7 +348,7 @@ class ProductionPlanner:
     
     def clear_reservations(self):
         """Очистить все резервирования"""
-        self.reserved_materials.clear()
+        self._set_reserved({})
         self.selected_orders.clear()
         try:
             if os.path.exists('reservations.json'):
@@ -233,13 +363,14 @@ class ProductionPlanner:
         if not requirements.get('purchase_requirements'):
             return "Заявка на закупку не требуется - все материалы в наличии", None
         
-        purchase_text = "ЗАЯВКА НА ЗАКУПКУ МАТЕРИАЛОВ\n"
-        purchase_text += "=" * 50 + "\n"
-        purchase_text += f"Дата формирования: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-        purchase_text += f"Для заказов: {', '.join(self.selected_orders.keys())}\n\n"
-        
-        purchase_text += "СПИСОК МАТЕРИАЛОВ ДЛЯ ЗАКУПКИ:\n"
-        purchase_text += "-" * 50 + "\n"
+        parts = [
+            "ЗАЯВКА НА ЗАКУПКУ МАТЕРИАЛОВ\n",
+            "=" * 50 + "\n",
+            f"Дата формирования: {datetime.now().strftime('%d.%m.%Y %H:%M')}\n",
+            f"Для заказов: {', '.join(self.selected_orders.keys())}\n\n",
+            "СПИСОК МАТЕРИАЛОВ ДЛЯ ЗАКУПКИ:\n",
+            "-" * 50 + "\n",
+        ]
         
         total_cost_estimate = 0
         
@@ -248,17 +379,20 @@ class ProductionPlanner:
             total_cost = estimated_price * quantity
             total_cost_estimate += total_cost
             
-            purchase_text += f"📦 {material}\n"
-            purchase_text += f"   Количество: {quantity:.2f}\n"
-            purchase_text += f"   Примерная стоимость: {total_cost:,.2f} руб.\n\n"
+            parts.append(f"📦 {material}\n")
+            parts.append(f"   Количество: {quantity:.2f}\n")
+            parts.append(f"   Примерная стоимость: {total_cost:,.2f} руб.\n\n")
         
-        purchase_text += f"ОБЩАЯ ПРИМЕРНАЯ СТОИМОСТЬ: {total_cost_estimate:,.2f} руб.\n"
+        parts.append(f"ОБЩАЯ ПРИМЕРНАЯ СТОИМОСТЬ: {total_cost_estimate:,.2f} руб.\n")
+        purchase_text = ''.join(parts)
         
         # Сохраняем в файл
         filename = f"Заявка_на_закупку_{datetime.now().strftime('%Y%m%d_%H%M')}.txt"
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                f.write(purchase_text)
+            # Кодируем текст один раз и пишем байты одним вызовом
+            data = purchase_text.replace('\n', os.linesep).encode('utf-8')
+            with open(filename, 'wb', buffering=1 << 16) as f:
+                f.write(data)
             return purchase_text, filename
         except Exception as e:
             print(f"❌ Ошибка сохранения заявки: {e}")
@@ -266,23 +400,7 @@ class ProductionPlanner:
     
     def estimate_material_price(self, material):
         """Оценочная стоимость материала"""
-        material_lower = material.lower()
-        
-        # Базовые цены на основные материалы
-        if any(x in material_lower for x in ['стекло', 'glass']):
-            return 1500
-        elif any(x in material_lower for x in ['профиль', 'profile']):
-            return 800
-        elif any(x in material_lower for x in ['аргон', 'argon']):
-            return 200
-        elif any(x in material_lower for x in ['герметик', 'sealant']):
-            return 1500
-        elif any(x in material_lower for x in ['лента', 'tape']):
-            return 300
-        elif any(x in material_lower for x in ['соединитель', 'connector']):
-            return 500
-        else:
-            return 1000  # цена по умолчанию
+        return _estimate_price(material)
 
 def main():
     """Основная функция для консольного интерфейса"""
@@ -359,12 +477,18 @@ def show_orders_menu(planner):
         print(f"\n📊 Заказы для '{selected_company}' ({len(orders)}):")
         print("-" * 100)
         
-        for _, order in orders.iterrows():
-            order_num = str(order['Номер заказа'])
-            client = str(order['Клиент']) if pd.notna(order['Клиент']) else "Не указан"
-            status = str(order.get('Состояние заказа', 'Не указано'))
-            cost = order.get('Стоимость заказа', 0)
-            area = order.get('Площадь заказа', 0)
+        # Идем по колонкам напрямую, без создания Series на каждую строку
+        rows = zip(
+            orders['Номер заказа'],
+            orders['Клиент'],
+            orders.get('Состояние заказа', repeat('Не указано')),
+            orders.get('Стоимость заказа', repeat(0)),
+            orders.get('Площадь заказа', repeat(0))
+        )
+        for order_num, client, status, cost, area in rows:
+            order_num = str(order_num)
+            client = str(client) if pd.notna(client) else "Не указан"
+            status = str(status)
             
             print(f"📋 {order_num} | {client} | {status} | {area} м² | {cost:,.2f} руб.")
             
@@ -375,7 +499,7 @@ def select_orders_menu(planner):
     """Меню выбора заказов"""
     print("\n🎯 ВЫБОР ЗАКАЗОВ ДЛЯ ПЛАНИРОВАНИЯ")
     
-    all_orders = [str(x) for x in planner.orders_df['Номер заказа'].unique() if pd.notna(x)]
+    all_orders = planner.get_order_numbers()
     print(f"Всего заказов: {len(all_orders)}")
     
     print("\nПримеры заказов:")
@@ -394,9 +518,10 @@ def select_orders_menu(planner):
     # Проверяем существование заказов
     valid_orders = []
     invalid_orders = []
+    all_orders_set = set(all_orders)
     
     for order_num in order_numbers:
-        if any(str(existing_order).strip() == order_num for existing_order in all_orders):
+        if order_num in all_orders_set:
             valid_orders.append(order_num)
         else:
             invalid_orders.append(order_num)
@@ -443,7 +568,8 @@ def select_orders_menu(planner):
 
 def show_reservations(planner):
     """Показать текущие резервирования"""
-    if not planner.reserved_materials:
+    reserved_materials = planner.reserved_snapshot()
+    if not reserved_materials:
         print("📭 Нет активных резервирований")
         return
     
@@ -457,12 +583,12 @@ def show_reservations(planner):
         client = order_info.get('Клиент', 'Не указан')
         print(f"  🚚 {order_num} ({client}) - отгрузка: {date_str}")
     
-    print(f"\n📦 ЗАРЕЗЕРВИРОВАННЫЕ МАТЕРИАЛЫ ({len(planner.reserved_materials)} позиций):")
-    for material, quantity in list(planner.reserved_materials.items())[:20]:  # Показываем первые 20
+    print(f"\n📦 ЗАРЕЗЕРВИРОВАННЫЕ МАТЕРИАЛЫ ({len(reserved_materials)} позиций):")
+    for material, quantity in list(reserved_materials.items())[:20]:  # Показываем первые 20
         print(f"  📍 {material}: {quantity:.2f}")
     
-    if len(planner.reserved_materials) > 20:
-        print(f"  ... и еще {len(planner.reserved_materials) - 20} материалов")
+    if len(reserved_materials) > 20:
+        print(f"  ... и еще {len(reserved_materials) - 20} материалов")
 
 def calculate_requirements(planner):
     """Рассчитать потребности в материалах"""